@@ -7,24 +7,44 @@ class Enumeration:
     This class doesn't interfere with Python's Enum class namespace, but watch out for typos/confusion.
     """
     _enum_values = []
+    _enum_values_set = frozenset()
+    _enum_values_lower_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # load enum values of every custom enum right away -> 'enum_values' just returns them, no freshness checks
+        cls._load_enum_values()
+
+    @classmethod
+    def _load_enum_values(cls):
+        """
+        Load current enum values and save them (with their lookup sets) to the enum class.
+        """
+        # skip attributes of this base class (cached values etc.), dunder attributes and methods defined in the enum
+        skip = cls._SKIP
+        values = [value for name, value in vars(cls).items()
+                  if name not in skip and name[:2] != '__' and not callable(value)
+                  and not isinstance(value, (classmethod, staticmethod))]
+        cls._enum_values = values
+        # hashed copy of the values for fast membership tests (fall back to the list if any value is unhashable)
+        try:
+            cls._enum_values_set = frozenset(values)
+        except TypeError:
+            cls._enum_values_set = values
+        # lowercased string values for case-insensitive lookups (lowercase them once, not per lookup)
+        cls._enum_values_lower_set = frozenset(value.lower() for value in values if isinstance(value, str))
 
     @classmethod
     def enum_values(cls, refresh=False):
         """
         Get list of all values in the enum.
-        Note: Enum values are loaded only once by default - at first use (enum is not supposed to change
+        Note: Enum values are loaded only once - when the enum class is created (enum is not supposed to change
         dynamically). To refresh/load up-to-date values when calling this, use 'refresh' parameter.
         :param refresh - set True to force refresh of current values when calling this method
         :return list of enum values. Example: ['Day', 'Night']
         """
-        # load enum values once and save them for future usage (unless forced refresh)
-        if refresh or not cls._enum_values:  # if forced refresh or enum values not saved yet, load them
-            values = []
-            for name, value in cls.__dict__.items():
-                if not name.startswith('__'):
-                    values.append(value)
-
-            cls._enum_values = values
+        if refresh:
+            cls._load_enum_values()
 
         return cls._enum_values
 
@@ -39,17 +59,20 @@ class Enumeration:
         :return True if enum contains the item, False otherwise
         """
         # TODO comparison using unicodedata NFKD normalization
+        if refresh:
+            cls._load_enum_values()
+
         if (ignore_case is True) and isinstance(item, str):
-            item = item.lower()
-            for value in cls.enum_values(refresh=refresh):
-                if isinstance(value, str) and (item == value.lower()):
-                    # item matched a value
-                    return True
+            return item.lower() in cls._enum_values_lower_set
 
-            # item did not match any value
-            return False
-        else:
-            return True if item in cls.enum_values(refresh=refresh) else False
+        try:
+            return item in cls._enum_values_set
+        except TypeError:  # unhashable item, can't be looked up in a set
+            return item in cls._enum_values
+
+
+# names of the base class attributes, these are never enum values (hashed set -> fast check per attribute)
+Enumeration._SKIP = frozenset(vars(Enumeration)) | {'_SKIP'}
 
 
 """ USAGE EXAMPLE """
@@ -69,7 +92,7 @@ if __name__ == '__main__':
     # check if an item is in the enum
     my_days = ['Sunday', 'Monday', WorkDay.tue]
     for my_day in my_days:
-        if my_day in WorkDay.enum_values():
+        if WorkDay.contains(my_day):
             print("Go to work. It is " + my_day)
         else:
             print("Stay at home. It is " + my_day)
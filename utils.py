@@ -1,114 +1,411 @@
-import glob
+import functools
+import mmap
 import os
 import re
+import stat
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, newlines are counted by bytes.count() without it
+    np = None
 
-def count_lines(path, recursive=True, filters=None):
+# names of dirs that are not searched when counting lines by default (VCS data, caches, virtualenvs, dependencies)
+IGNORED_DIRS = frozenset({'.git', '.hg', '.svn', '__pycache__', '.venv', 'venv', 'node_modules', '.tox', '.mypy_cache'})
+
+_READ_CHUNK_SIZE = 1 << 20  # [bytes] files are read (and newlines counted) by chunks of this size
+_MMAP_MIN_SIZE = 16 << 20  # [bytes] files of this size or bigger are memory-mapped and counted by numpy (if available)
+# simple extension filter, e.g. r'\w*.py' or r'\w*\.py' -> matched by a plain str.endswith instead of regex
+_EXTENSION_FILTER = re.compile(r'\\w\*\\?\.(\w+)')
+_ALTERNATION_MIN_FILTERS = 4  # this many (or more) regex file filters are combined into a single pattern
+_PARALLEL_MIN_FILES = 8  # fewer files than this are counted sequentially (thread pool overhead wouldn't pay off)
+_WAIT_MIN_PERIOD = 0.001  # [seconds] first check period of 'wait_for', doubled after each failed check (up to 'period')
+
+
+def count_lines(path, recursive=True, filters=None, ignore_dirs=IGNORED_DIRS):
     """
     Count lines in given file/directory. May also search recursively in subdirs etc.
-    Can be filtered, e.g. only certain file types. Note: If no filters given, searching directories may fail,
-    because they may contain some file types (e.g. archives) that can't be read properly as UTF-8 symbols (searching newlines).
-    Note 2: Doesn't count 1 last empty line.
+    Can be filtered, e.g. only certain file types. Note: If no filters given, all files are counted, including
+    binary ones (e.g. archives) - their "lines" are just newline bytes found in them.
+    Note 2: Doesn't count 1 last empty line. Only LF newlines are counted, lone CR (old Mac style) is not a newline.
     :param path: target file or directory
     :param recursive: recursively count lines also in all files in subdirs, subsubdirs, ..., etc.
     :param filters: count line only in files matching any of these filters. Filters are regex patterns.
-        Example: [r'\w*.py', r'\w*.sh'] to match *.py and *.sh files
+        Example: [r'\w*.py', r'\w*.sh'] to match *.py and *.sh files (simple filters like these are treated as file extensions)
+    :param ignore_dirs: names of (sub)dirs that are not searched at all, by default VCS dirs, caches, virtualenvs etc.
     :return: number of lines in given file or directory
     """
     if os.path.isdir(path):
-        return count_dir_lines(path, recursive, filters)
+        return count_dir_lines(path, recursive, filters, ignore_dirs)
     elif os.path.isfile(path):
         return count_file_lines(path)
     else:
         raise FileNotFoundError("Path {} does not exist!".format(path))
 
 
-def count_dir_lines(dir_path, recursive=False, file_filters=None):
+def count_dir_lines(dir_path, recursive=False, file_filters=None, ignore_dirs=IGNORED_DIRS):
     """
     Count lines in all files in given directory. May also search recursively in subdirs etc.
-    Results can be filtered, e.g. only certain file types. Note: If no filters given, searching may fail,
-    because some file types (e.g. archives) can't be read properly as UTF-8 symbols (searching newlines).
+    Results can be filtered, e.g. only certain file types. Note: If no filters given, all files are counted,
+    including binary ones (e.g. archives) - their "lines" are just newline bytes found in them.
     :param dir_path: path to the directory
     :param recursive: recursively count also all files in subdirs, subsubdirs, ..., etc.
     :param file_filters: Count only files matching any of these filters. Filter are regular exp. patterns.
-        Example: [r'\w*.py', r'\w*.sh'] to match all *.py and *.sh files
+        Example: [r'\w*.py', r'\w*.sh'] to match all *.py and *.sh files. Note: Simple filters like these (r'\w*.ext' or
+        r'\w*\.ext') are treated as file extensions, i.e. matched as "name ends with .ext" without regex.
+    :param ignore_dirs: names of subdirs that are not searched at all (skipped with all their content),
+        by default VCS dirs, caches, virtualenvs etc. (see IGNORED_DIRS). Set empty to search all subdirs.
     :return number of lines in all files in given directory (based on given params and filters),
         return -1 if directory not found
     """
     if os.path.exists(dir_path):
-        lines = 0
-        # list all files/dirs, filter them if any filters given
-        for file in glob.glob(os.path.join(dir_path, '**'), recursive=recursive):
-            if os.path.isfile(file):
-                if file_filters:
-                    # count only lines in files matching given filters
-                    for name_filter in file_filters:
-                        if re.match(name_filter, os.path.basename(file)):
-                            lines += count_file_lines(file)
-                            break  # in case more filters would match one file
-                else:
-                    # no filters given, count lines in all found files
-                    lines += count_file_lines(file)
-        return lines
+        name_matches = _make_name_matcher(file_filters) if file_filters else None  # no filters -> count all files
+        files = []
+        # list all files (absolute paths, same as cache keys of counted files), filter them if any filters given
+        for entry in _iter_files(os.path.abspath(dir_path), recursive, frozenset(ignore_dirs or ())):
+            if name_matches is None or name_matches(entry.name):
+                files.append(entry)
+
+        if len(files) < _PARALLEL_MIN_FILES:
+            return sum(map(_count_entry_lines, files))
+        # counting is mostly I/O and C-level scanning (GIL released) -> overlap it in threads
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            return sum(executor.map(_count_entry_lines, files))
     else:
         # given path does not exist
         print("Error: Given path not found: {}".format(dir_path), file=sys.stderr)
         return -1
 
 
+def _make_name_matcher(file_filters):
+    """
+    Prepare a matcher for file names from given filters (see 'count_dir_lines'), so nothing is parsed/compiled per file.
+    :param file_filters: non-empty list of regex patterns
+    :return: callable taking file name, returning truthy value if the name matches any of the filters
+    """
+    # simple extension filters -> plain suffix check (no regex), the rest stays regex
+    suffixes = []
+    regex_filters = []
+    for name_filter in file_filters:
+        extension = _EXTENSION_FILTER.fullmatch(name_filter)
+        if extension:
+            suffixes.append('.' + extension.group(1))
+        else:
+            regex_filters.append(name_filter)
+    suffixes = tuple(suffixes)
+
+    regex_matches = _make_regex_matcher(regex_filters) if regex_filters else None
+    if regex_matches is None:
+        return lambda name: name.endswith(suffixes)
+    if not suffixes:
+        return regex_matches
+    return lambda name: name.endswith(suffixes) or regex_matches(name)
+
+
+def _make_regex_matcher(regex_filters):
+    """
+    Prepare a matcher for file names from given regex filters, see '_make_name_matcher'.
+    :param regex_filters: non-empty list of regex patterns
+    :return: callable taking file name, returning truthy value if the name matches any of the filters
+    """
+    patterns = [re.compile(name_filter) for name_filter in regex_filters]
+    if len(patterns) == 1:
+        return patterns[0].match
+    # patterns with groups can't be combined - joining renumbers the groups, so backreferences would point elsewhere
+    groupless = [pattern for pattern in patterns if pattern.groups == 0]
+    if len(groupless) >= _ALTERNATION_MIN_FILTERS:
+        try:
+            # many filters -> combine them into one compiled pattern, i.e. single regex match per file
+            combined = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern in groupless))
+            patterns = [combined] + [pattern for pattern in patterns if pattern.groups]
+        except re.error:  # some patterns can't be combined (e.g. global inline flags like '(?i)' must be at the start)
+            pass
+    if len(patterns) == 1:
+        return patterns[0].match
+    return lambda name: any(pattern.match(name) for pattern in patterns)
+
+
+def _iter_files(dir_path, recursive, ignore_dirs):
+    """
+    Iterate over all files in given directory (and its subdirs, subsubdirs, ..., etc. if 'recursive' is set).
+    Hidden files/dirs (name starting with '.') are skipped and symlinked dirs are not followed. Unreadable dirs are skipped.
+    Subdirs with name in 'ignore_dirs' (set of names) are skipped too.
+    :return: generator of os.DirEntry objects of the found files
+    """
+    try:
+        with os.scandir(dir_path) as scanner:
+            entries = list(scanner)  # don't keep the dir open while descending into subdirs
+    except OSError:
+        return
+
+    for entry in entries:
+        if entry.name[:1] == '.':
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if recursive and entry.name not in ignore_dirs:
+                yield from _iter_files(entry.path, recursive, ignore_dirs)
+        elif entry.is_file():
+            yield entry
+
+
 def count_file_lines(file_path):
     """
     Count lines in given file. Ignores empty last line (only one).
+    Only LF newlines are counted (also in CRLF), lone CR (old Mac style) is not a newline.
+    Results are cached for unchanged files (same path, modification time and size), use 'count_file_lines.cache_clear()'
+    to drop the cache.
     :param file_path: path to the file
     :return number of lines in the file, return -1 if file not found
     """
-    if os.path.isfile(file_path):
-        i = 0
-        with open(file_path, 'r') as f:
-            for i, l in enumerate(f):
-                pass
-        return i+1
+    try:
+        file_stat = os.stat(file_path)
+    except (OSError, ValueError):
+        file_stat = None
+
+    if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+        return _count_file_lines(os.path.abspath(file_path), file_stat.st_mtime_ns, file_stat.st_size)
     else:
         print("Error: Not a file: {}".format(file_path))
         return -1
 
 
-def _wait_for_variable(condition: Any, expected_value: Any, end_time: float, period: float):
+def _count_entry_lines(entry):
+    """
+    Count lines in a file found by directory scan, see 'count_file_lines'. Skips the path checks of 'count_file_lines',
+    which are a significant part of the cost for small files.
+    :param entry: os.DirEntry of the file (with absolute path)
+    :return number of lines in the file, return 0 if file can't be read (e.g. no permission or removed meanwhile),
+        so it doesn't affect the directory total
+    """
+    try:
+        entry_stat = entry.stat()
+        return _count_file_lines(entry.path, entry_stat.st_mtime_ns, entry_stat.st_size)
+    except OSError as error:
+        print("Error: Can't read file: {} ({})".format(entry.path, error), file=sys.stderr)
+        return 0
+
+
+def _count_file_lines(file_path, mtime_ns, size):
+    """
+    Count lines in given file, see 'count_file_lines'. Empty files are never cached - pseudo files (e.g. procfs)
+    report zero size and their modification time doesn't change, so a cached count would get stale.
+    :return number of lines in the file
+    """
+    if size == 0:
+        return _read_file_lines(file_path, size)
+    return _cached_file_lines(file_path, mtime_ns, size)
+
+
+@functools.lru_cache(maxsize=8192)
+def _cached_file_lines(file_path, mtime_ns, size):
+    """
+    Cached '_read_file_lines'. The 'mtime_ns' and 'size' are only part of the cache key, so a changed file is counted again.
+    :return number of lines in the file
+    """
+    return _read_file_lines(file_path, size)
+
+
+count_file_lines.cache_clear = _cached_file_lines.cache_clear
+
+
+def _read_file_lines(file_path, size):
+    """
+    Read given file and count its lines, see 'count_file_lines'.
+    :param size: [bytes] file size reported by stat
+    :return number of lines in the file
+    """
+    # count newlines in raw bytes - no decoding and no per-line objects needed
+    fd = os.open(file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        newlines, last_byte = None, b''
+        if np is not None and size >= _MMAP_MIN_SIZE:
+            newlines, last_byte = _count_newlines_mmap(fd)
+        if newlines is None:  # no numpy, small file or file can't be memory-mapped
+            if size > _READ_CHUNK_SIZE and hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)  # hint the kernel to read ahead aggressively
+            newlines, last_byte = _count_newlines_chunked(fd, size)
+    finally:
+        os.close(fd)
+
+    # last line doesn't have to end with a newline (an empty last line is not counted)
+    return newlines if last_byte == b'\n' else newlines + 1
+
+
+def _count_newlines_chunked(fd, size):
+    """
+    Count newline bytes in given file (descriptor) by reading it in chunks.
+    :param size: [bytes] expected file size - once it is read and a read returns less than a whole chunk, the end of file
+        is reached (saves the extra empty read, i.e. a whole small file is counted by a single read). Zero size means
+        unknown size (e.g. procfs files), such files are read until the end of file.
+    :return: 1) number of newlines, 2) last byte of the file (b'' if the file is empty)
+    """
+    newlines = 0
+    last_byte = b''
+    read_bytes = 0
+    if 0 < size < _READ_CHUNK_SIZE:
+        # small file -> read it at once, no chunk buffer needed (one extra byte requested to detect the end of file)
+        data = os.read(fd, size + 1)
+        if len(data) == size:
+            return data.count(b'\n'), data[-1:]
+        newlines = data.count(b'\n')  # file changed meanwhile, continue by chunks
+        last_byte = data[-1:] or last_byte
+        read_bytes = len(data)
+
+    # one buffer for all chunks of the file -> no new bytes object per chunk, newlines are counted in place
+    buffer = bytearray(_READ_CHUNK_SIZE)
+    while True:
+        chunk_size = _read_into(fd, buffer)
+        if not chunk_size:
+            break
+        newlines += buffer.count(b'\n', 0, chunk_size)
+        last_byte = bytes(buffer[chunk_size - 1:chunk_size])
+        read_bytes += chunk_size
+        if size and read_bytes >= size and chunk_size < _READ_CHUNK_SIZE:
+            break
+    return newlines, last_byte
+
+
+if hasattr(os, 'readv'):
+    def _read_into(fd, buffer):
+        """
+        Read from given file (descriptor) into given buffer.
+        :return: number of bytes read (0 at the end of file)
+        """
+        return os.readv(fd, (buffer,))
+else:  # e.g. Windows - no os.readv, copy the read data into the buffer
+    def _read_into(fd, buffer):
+        """
+        Read from given file (descriptor) into given buffer.
+        :return: number of bytes read (0 at the end of file)
+        """
+        chunk = os.read(fd, len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def _count_newlines_mmap(fd):
+    """
+    Count newline bytes in given file (descriptor) using memory map and vectorized numpy comparison.
+    :return: 1) number of newlines, 2) last byte of the file; (None, b'') if the file can't be memory-mapped
+    """
+    try:
+        mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # e.g. pipes, special files or empty files
+        return None, b''
+
+    with mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        newlines = 0
+        # compare by chunks, so the temporary bool array doesn't have the size of the whole file
+        for start in range(0, len(data), _READ_CHUNK_SIZE):
+            newlines += int(np.count_nonzero(data[start:start + _READ_CHUNK_SIZE] == 0x0A))
+        last_byte = mm[-1:]
+        del data  # release the buffer export, otherwise the memory map can't be closed
+    return newlines, last_byte
+
+
+def _event_sleep(event: threading.Event, seconds: float):
+    """
+    Sleep for given time [seconds], wake up earlier if the event gets set. The event is not modified - while it is set,
+    this is a plain sleep (waiting on a set event would return immediately, i.e. busy polling).
+    """
+    if event.is_set():
+        time.sleep(seconds)
+    else:
+        event.wait(seconds)
+
+
+def _make_variable_waiter(condition: Any, expected_value: Any, period: float, event: Optional[threading.Event]) -> Callable:
     """
-    Same as 'wait_for', but only supports variable conditions (non-callable). The 'end_time' [timestamp] is the time when waiting is ended.
-    :return: 1) True if condition passed under given timeout, False otherwise, 2) latest value of the condition
+    Same as 'make_waiter', but only supports variable conditions (non-callable).
+    :return: function waiting until given 'end_time' [monotonic timestamp], returning 1) True if condition passed
+        in time, False otherwise, 2) latest value of the condition
     """
-    latest_value = condition
-    while time.time() < end_time:
-        if latest_value == expected_value:
-            return True, latest_value
+    # bind everything used in the loop to locals (no global/attribute lookups per check)
+    now = time.monotonic
+    sleep = time.sleep if event is None else functools.partial(_event_sleep, event)
+    first_sleep_time = min(_WAIT_MIN_PERIOD, period)
 
-        time.sleep(period)
+    def wait_until(end_time: float):
         latest_value = condition
+        sleep_time = first_sleep_time
+        while now() < end_time:
+            if latest_value == expected_value:
+                return True, latest_value
+
+            sleep(sleep_time)
+            sleep_time = min(period, sleep_time * 2)
+            latest_value = condition
+
+        return False, latest_value
+
+    return wait_until
+
+
+def _make_callable_waiter(condition: Callable, args: list, kwargs: dict, expected_value: Any, period: float,
+                          event: Optional[threading.Event]) -> Callable:
+    """
+    Same as 'make_waiter', but only supports callable conditions.
+    :return: function waiting until given 'end_time' [monotonic timestamp], returning 1) True if condition passed
+        in time, False otherwise, 2) latest value of the condition
+    """
+    # bind everything used in the loop to locals, call condition directly if there are no args to unpack
+    now = time.monotonic
+    sleep = time.sleep if event is None else functools.partial(_event_sleep, event)
+    check = functools.partial(condition, *args, **kwargs) if (args or kwargs) else condition
+    first_sleep_time = min(_WAIT_MIN_PERIOD, period)
+
+    def wait_until(end_time: float):
+        latest_value = check()
+        sleep_time = first_sleep_time
+        while now() < end_time:
+            if latest_value == expected_value:
+                return True, latest_value
+            sleep(sleep_time)
+            sleep_time = min(period, sleep_time * 2)
+            latest_value = check()
 
-    return False, latest_value
+        return False, latest_value
 
+    return wait_until
 
-def _wait_for_callable(condition: Callable, args: list, kwargs: dict, expected_value: Any, end_time: float, period: float):
+
+def make_waiter(condition: Any, args: Optional[list] = None, kwargs: Optional[dict] = None, expected_value: Any = True,
+                period: float = 1, raise_exc: bool = False, event: Optional[threading.Event] = None) -> Callable[[float], bool]:
     """
-    Same as 'wait_for', but only supports callable conditions. The 'end_time' [timestamp] is the time when waiting is ended.
-    :return: 1) True if condition passed under given timeout, False otherwise, 2) latest value of the condition
+    Prepare a reusable 'wait_for' for given condition. All the setup (condition type check, args binding) is done only once,
+    which pays off if the same condition is waited for repeatedly. Params are the same as for 'wait_for'.
+    :return: function 'wait(timeout=10)' behaving as 'wait_for' with the params given here
+    Example: wait_for_file = make_waiter(os.path.exists, args=[path], period=0.2)
+             while run_test():
+                 wait_for_file(timeout=5)
     """
-    latest_value = condition(*args, **kwargs)
-    while time.time() < end_time:
-        if (latest_value) == expected_value:
-            return True, latest_value
-        time.sleep(period)
-        latest_value = condition(*args, **kwargs)
+    if callable(condition):
+        wait_until = _make_callable_waiter(condition, args if args else [], kwargs if kwargs else {}, expected_value,
+                                           period, event)
+    else:
+        wait_until = _make_variable_waiter(condition, expected_value, period, event)
+
+    def wait(timeout: float = 10) -> bool:
+        result, last_value = wait_until(time.monotonic() + timeout)
+        if result is False and raise_exc:
+            raise TimeoutError(f'Condition not fulfilled in time:\nExpected value: {expected_value}\nActual value: {last_value}')
+
+        return result
 
-    return False, latest_value
+    return wait
 
 
 def wait_for(condition: Any, args: Optional[list] = None, kwargs: Optional[dict] = None, expected_value: Any = True,
-             timeout: float = 10, period: float = 1, raise_exc: bool = False) -> bool:
+             timeout: float = 10, period: float = 1, raise_exc: bool = False, event: Optional[threading.Event] = None) -> bool:
     """
     Wait for any condition (variable/callable) to have the expected value. Condition is checked periodically until the timeout is reached.
+    Checks start at 1 ms intervals, the interval is doubled after each failed check up to the given 'period'.
+    To wait for the same condition repeatedly, see 'make_waiter'.
     :param condition: variable or callable object that is checked
     :param args: args for callable condition (all in a single list)
     :param kwargs: kwargs for callable condition (all in a single dict)
@@ -116,24 +413,16 @@ def wait_for(condition: Any, args: Optional[list] = None, kwargs: Optional[dict]
     :param timeout: [seconds] max wait time
     :param period: [seconds] interval to periodically check condition
     :param raise_exc: if waiting is not successful -> raise TimeoutError exception (instead of returning "False")
+    :param event: optional event to wake up the waiting - setting it makes the condition to be re-checked immediately.
+        The event is not modified (not cleared). While it stays set, the condition is checked periodically as usual;
+        clear and set it again to trigger another immediate re-check.
     :return: True if condition passed under given timeout, False otherwise
     Examples: wait_for(lambda: os.path.exists(path))  # wait for file existence (using lambda), return False if not created
               wait_for(math.is_close, args=[my_var, 42], kwargs={'abs_tol': 0.01}, expected_value=True, timeout=5, period=0.2)
               wait_for(os.path.exists, args=[path], raise_exc=True)  # wait for file existence (using a callable with args),
                                                                      raise TimeoutError if file hasn't been created in time
     """
-    end_time = time.time() + timeout
-    if callable(condition):
-        args = args if args else []
-        kwargs = kwargs if kwargs else {}
-        result, last_value = _wait_for_callable(condition, args, kwargs, expected_value, end_time, period)
-    else:
-        result, last_value = _wait_for_variable(condition, expected_value, end_time, period)
-
-    if result is False and raise_exc:
-        raise TimeoutError(f'Condition not fulfilled in time:\nExpected value: {expected_value}\nActual value: {last_value}')
-
-    return result
+    return make_waiter(condition, args, kwargs, expected_value, period, raise_exc, event)(timeout)
 
 
 """ EXAMPLE USAGE """